@@ -3,12 +3,23 @@ import json
 import sys
 from pathlib import Path
 import pyperclip
-from .context_generator import create_llm_context
+from .context_generator import ContextBuilder
+from .manifest import load_manifest, save_manifest
 
 def progress_callback(message):
     """Простой колбэк для вывода прогресса в консоль."""
     print(message, file=sys.stderr)
 
+def positive_int(value: str) -> int:
+    """Тип argparse: целое число не меньше 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается целое число, получено '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"значение должно быть не меньше 1, получено {number}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(
         description="Собирает контекст проекта для LLM из командной строки.",
@@ -16,7 +27,7 @@ def main():
     )
     parser.add_argument(
         "repo_path",
-        help="Путь к папке проекта."
+        help="Путь к папке проекта или к архиву (.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz)."
     )
     parser.add_argument(
         "-c", "--config",
@@ -51,11 +62,45 @@ def main():
     parser.add_argument(
         '--no-tree', action='store_false', dest='include_tree', help='Не включать дерево проекта.'
     )
+    parser.add_argument(
+        '--tree-depth', type=positive_int, help='Максимальная глубина дерева проекта.'
+    )
+    parser.add_argument(
+        '--tree-max-entries', type=positive_int,
+        help='Максимум элементов на папку в дереве; остальные сворачиваются в итоговую строку.'
+    )
     parser.add_argument(
         '--max-chars', type=int, help='Переопределить лимит символов на файл.'
     )
+    parser.add_argument(
+        '--max-total-chars', type=int,
+        help='Общий лимит символов содержимого; остальные файлы не читаются и перечисляются в конце.'
+    )
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='Только оценить размер контекста (число файлов, байты, токены) без чтения содержимого.'
+    )
+    parser.add_argument(
+        '--ref', help='Собрать контекст из git-ревизии (ветка, тег, коммит) без checkout.'
+    )
+    parser.add_argument(
+        '--write-manifest', metavar='PATH',
+        help='Сохранить манифест выданных файлов с хэшами содержимого (для --delta-from).'
+    )
+    parser.add_argument(
+        '--delta-from', metavar='PATH',
+        help='Выдать только файлы, добавленные или измененные с момента манифеста, и список удаленных.'
+    )
+    parser.add_argument(
+        '--query', help='Отобрать файлы, релевантные запросу (ранжирование BM25 по локальному индексу).'
+    )
+    parser.add_argument(
+        '--budget', type=int, help='Бюджет символов для содержимого файлов в режиме --query.'
+    )
 
     args = parser.parse_args()
+    if args.budget is not None and not args.query:
+        parser.error("--budget можно использовать только вместе с --query")
 
     # --- Загрузка конфигурации ---
     config = {
@@ -65,7 +110,10 @@ def main():
         "exclude_files": [],
         "exclude_ext": [],
         "include_tree": True,
-        "max_chars_per_file": 100000
+        "max_chars_per_file": 100000,
+        "tree_depth": None,
+        "tree_max_entries": None,
+        "max_total_chars": None
     }
 
     config_path = Path(args.config)
@@ -89,13 +137,22 @@ def main():
     if args.exclude_files is not None: config['exclude_files'] = args.exclude_files
     if args.exclude_ext is not None: config['exclude_ext'] = args.exclude_ext
     if args.max_chars is not None: config['max_chars_per_file'] = args.max_chars
+    if args.max_total_chars is not None: config['max_total_chars'] = args.max_total_chars
+    if args.tree_depth is not None: config['tree_depth'] = args.tree_depth
+    if args.tree_max_entries is not None: config['tree_max_entries'] = args.tree_max_entries
     # Действие 'store_false' для no-tree само обновит args.include_tree
     config['include_tree'] = args.include_tree
 
+    # Значения из аргументов уже проверены argparse, из конфигурации — нет
+    for key in ('tree_depth', 'tree_max_entries'):
+        value = config[key]
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            print(f"❌ Ошибка в конфигурации: {key} должно быть целым числом не меньше 1, получено {value!r}", file=sys.stderr)
+            sys.exit(1)
+
 
     try:
-        progress_callback("🚀 Запускаю сборку контекста...")
-        result = create_llm_context(
+        with ContextBuilder(
             repo_path_str=args.repo_path,
             include_ext=config['include_ext'],
             include_files=config['include_files'],
@@ -104,8 +161,28 @@ def main():
             exclude_ext=config['exclude_ext'],
             include_tree=config['include_tree'],
             max_chars_per_file=config['max_chars_per_file'],
+            max_total_chars=config['max_total_chars'],
+            tree_depth=config['tree_depth'],
+            tree_max_entries=config['tree_max_entries'],
+            ref=args.ref,
             progress_callback=progress_callback
-        )
+        ) as builder:
+            if args.stats:
+                progress_callback("📊 Оцениваю размер контекста...")
+                print(builder.stats())
+                return
+
+            delta_from = None
+            if args.delta_from:
+                delta_from = load_manifest(Path(args.delta_from), builder.source.cache_key)
+                progress_callback(f"ℹ️  Манифест загружен из {args.delta_from}")
+
+            progress_callback("🚀 Запускаю сборку контекста...")
+            result = builder.render(query=args.query, budget=args.budget, delta_from=delta_from)
+
+            if args.write_manifest:
+                save_manifest(Path(args.write_manifest), builder.last_manifest, builder.source.cache_key)
+                progress_callback(f"✅ Манифест сохранен в файл: {args.write_manifest}")
 
         if args.output:
             output_path = Path(args.output)
@@ -122,7 +199,7 @@ def main():
 
         progress_callback("🎉 Готово!")
 
-    except FileNotFoundError as e:
+    except (FileNotFoundError, ValueError) as e:
         print(f"❌ Ошибка: {e}", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
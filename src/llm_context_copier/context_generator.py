@@ -1,6 +1,10 @@
-from pathlib import Path
+import os
+from pathlib import Path, PurePosixPath
 import fnmatch
-from .file_utils import get_gitignore_matcher, get_gitattributes_matcher, get_project_structure
+from .file_utils import format_size
+from .sources import open_source
+from .relevance_index import RelevanceIndex, get_index_path
+from .manifest import content_hash
 
 # --- КОНФИГУРАЦИЯ ---
 DEFAULT_IGNORE_PATTERNS = [
@@ -9,21 +13,29 @@ DEFAULT_IGNORE_PATTERNS = [
     ".vscode", ".idea", "*.swp", "node_modules", "dist",
     "build", "target", "out", ".env", "*.log", "*.lock",
 ]
+# Приблизительное число символов на токен для оценок размера
+CHARS_PER_TOKEN = 4
 # --- КОНЕЦ КОНФИГУРАЦИИ ---
 
+def resolve_preset_path(name: str) -> Path:
+    """
+    Возвращает путь к файлу пресета по его имени.
+    """
+    # Пытаемся найти встроенный пресет
+    preset_path = Path(__file__).parent / "presets" / f"{name.lower()}.gitignore"
+    if not preset_path.exists():
+        # Пытаемся найти кастомный пресет по абсолютному или относительному пути
+        preset_path = Path(name)
+    return preset_path
+
+
 def load_presets(preset_names: list[str]) -> list[str]:
     """
     Загружает паттерны из указанных пресетов.
     """
     patterns = []
-    presets_dir = Path(__file__).parent / "presets"
     for name in preset_names:
-        # Пытаемся найти встроенный пресет
-        preset_path = presets_dir / f"{name.lower()}.gitignore"
-        if not preset_path.exists():
-            # Пытаемся найти кастомный пресет по абсолютному или относительному пути
-            preset_path = Path(name)
-        
+        preset_path = resolve_preset_path(name)
         if preset_path.is_file():
             try:
                 with open(preset_path, 'r', encoding='utf-8') as f:
@@ -35,72 +47,47 @@ def load_presets(preset_names: list[str]) -> list[str]:
                 print(f"Warning: Could not load preset {name}: {e}")
     return patterns
 
-def create_llm_context(
-    repo_path_str: str, include_ext: list, include_files: list,
-    exclude_folders: list, exclude_files: list, exclude_ext: list,
-    include_tree: bool, max_chars_per_file: int, progress_callback,
-    selected_presets: list = None
-) -> str:
+def collect_files(
+    source, include_ext: list, include_files: list, exclude_folders: list,
+    exclude_files: list, exclude_ext: list, preset_patterns: list,
+    gitignore_matcher, gitattributes_matcher
+) -> list:
     """
-    Собирает контекст из репозитория для LLM.
+    Обходит источник и применяет все фильтры. Возвращает отсортированный
+    список SourceEntry; содержимое файлов не читается.
     """
-    def send_progress(message):
-        """Отправляет сообщение о прогрессе, поддерживая и сигналы PyQt, и обычные функции."""
-        if hasattr(progress_callback, 'emit'):
-            progress_callback.emit(message)
-        else:
-            progress_callback(message)
-
-    repo_path = Path(repo_path_str).resolve()
-    if not repo_path.is_dir():
-        raise FileNotFoundError(f"Directory not found: {repo_path}")
-
-    send_progress("- Parsing .gitignore...")
-    gitignore_matcher = get_gitignore_matcher(repo_path)
-    send_progress("- Parsing .gitattributes...")
-    gitattributes_matcher = get_gitattributes_matcher(repo_path)
-    
-    preset_patterns = []
-    if selected_presets:
-        send_progress("- Loading presets...")
-        preset_patterns = load_presets(selected_presets)
-
-    all_excluded_folders = DEFAULT_IGNORE_PATTERNS + exclude_folders + [p for p in preset_patterns if '/' in p or '*' in p or '.' in p]
-    # Примечание: Мы добавляем все паттерны из пресетов в список исключений. 
-    # Для простоты пока будем проверять их через fnmatch или простое вхождение, 
-    # так как текущая архитектура полагается на список строк для папок.
-    
-    output_parts = []
-    
-    if include_tree:
-        send_progress("- Building project tree...")
-        tree_structure = get_project_structure(repo_path, all_excluded_folders, gitignore_matcher, gitattributes_matcher)
-        output_parts.append("Project file structure:\n=======================\n```\n" + tree_structure + "\n```\n")
-
-    output_parts.append("File contents:\n==============")
-    send_progress("- Finding files...")
-    files_to_process_set = set()
+    name_patterns = []
     for ext in include_ext:
         if ext and not ext.startswith('.'):
             ext = '.' + ext
         if ext:
-            files_to_process_set.update(repo_path.rglob(f'*{ext}'))
-    for filename in include_files:
-        if filename:
-            files_to_process_set.update(repo_path.rglob(filename))
-
-    final_file_list = []
-    for file_path in sorted(list(files_to_process_set)):
-        if not file_path.is_file():
-            continue
+            name_patterns.append(f'*{ext}')
+    # Имена без '/' проверяются по имени файла, пути — как в rglob (совпадение с конца пути)
+    name_patterns.extend(filename for filename in include_files if filename and '/' not in filename)
+    path_patterns = [filename for filename in include_files if filename and '/' in filename]
+
+    excluded_folder_names = set(DEFAULT_IGNORE_PATTERNS + exclude_folders)
+
+    def prune_dir(name: str) -> bool:
+        # Те же правила, что и для частей пути ниже, но без захода в папку
+        return name in excluded_folder_names or any(fnmatch.fnmatch(name, p) for p in preset_patterns)
+
+    def want_file(name: str, rel_path_str: str) -> bool:
+        if any(fnmatch.fnmatch(name, pattern) for pattern in name_patterns):
+            return True
+        return any(PurePosixPath(rel_path_str).match(pattern) for pattern in path_patterns)
+
+    final_entries = []
+    for entry in sorted(source.list_files(prune_dir, want_file)):
+        rel_path = PurePosixPath(entry.path)
+        file_path = source.root_path / rel_path
         if gitignore_matcher(file_path):
             continue
         if gitattributes_matcher(file_path):
             continue
         
-        rel_path = file_path.relative_to(repo_path)
         # Проверка через DEFAULT_IGNORE_PATTERNS и exclude_folders (точное совпадение частей пути)
-        if any(folder in (DEFAULT_IGNORE_PATTERNS + exclude_folders) for folder in rel_path.parts):
+        if any(folder in excluded_folder_names for folder in rel_path.parts):
             continue
             
         # Проверка через пресеты и дополнительные паттерны (через fnmatch)
@@ -108,35 +95,387 @@ def create_llm_context(
         rel_path_str = rel_path.as_posix()
         for pattern in preset_patterns:
             if fnmatch.fnmatch(rel_path_str, pattern) or \
-               fnmatch.fnmatch(file_path.name, pattern) or \
+               fnmatch.fnmatch(rel_path.name, pattern) or \
                any(fnmatch.fnmatch(p, pattern) for p in rel_path.parts):
                 match_found = True
                 break
         if match_found:
             continue
 
-        if file_path.name in exclude_files:
+        if rel_path.name in exclude_files:
+            continue
+        if rel_path.suffix in exclude_ext:
             continue
-        if file_path.suffix in exclude_ext:
+        final_entries.append(entry)
+    return final_entries
+
+
+def _mtime_ns(path: Path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ContextBuilder:
+    """
+    Сессия сборки контекста для одного репозитория и конфигурации.
+    Хранит скомпилированные матчеры .gitignore/.gitattributes, паттерны пресетов
+    и результат последнего обхода. Они пересобираются, только когда меняется
+    mtime исходных файлов (или, для обхода, mtime обойденных папок).
+    Архив, перезаписанный по тому же пути, открывается заново.
+    Используется GUI, CLI и любым встраивающим кодом.
+    """
+
+    def __init__(
+        self, repo_path_str: str, include_ext: list, include_files: list,
+        exclude_folders: list, exclude_files: list, exclude_ext: list,
+        include_tree: bool = True, max_chars_per_file: int = 100000,
+        selected_presets: list = None, tree_depth: int = None, tree_max_entries: int = None,
+        max_total_chars: int = None, ref: str = None, progress_callback=None
+    ):
+        self.repo_path_str = repo_path_str
+        self.ref = ref
+        self.source = open_source(repo_path_str, ref)
+        self._source_stamp = self.source.source_stamp()
+        self.include_ext = include_ext
+        self.include_files = include_files
+        self.exclude_folders = exclude_folders
+        self.exclude_files = exclude_files
+        self.exclude_ext = exclude_ext
+        self.include_tree = include_tree
+        self.max_chars_per_file = max_chars_per_file
+        self.selected_presets = selected_presets or []
+        self.tree_depth = tree_depth
+        self.tree_max_entries = tree_max_entries
+        self.max_total_chars = max_total_chars
+        # Колбэк можно менять между вызовами (например, на сигнал нового QThread-воркера)
+        self.progress_callback = progress_callback
+
+        self._matchers = None
+        self._matchers_stamp = None
+        self._preset_patterns = None
+        self._presets_stamp = None
+        self._files = None
+        self._files_stamp = None
+        self._scan_state = None
+        self.last_manifest = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.source.close()
+
+    def send_progress(self, message):
+        """Отправляет сообщение о прогрессе, поддерживая и сигналы PyQt, и обычные функции."""
+        if self.progress_callback is None:
+            return
+        if hasattr(self.progress_callback, 'emit'):
+            self.progress_callback.emit(message)
+        else:
+            self.progress_callback(message)
+
+    def _check_source(self):
+        """
+        Открывает источник заново, если он изменился целиком (например, архив
+        перезаписан по тому же пути); все кэши при этом сбрасываются.
+        """
+        if self.source.source_stamp() == self._source_stamp:
+            return
+        self.send_progress("- Source changed, reopening...")
+        self.source.close()
+        self.source = open_source(self.repo_path_str, self.ref)
+        self._source_stamp = self.source.source_stamp()
+        self._matchers = None
+        self._files = None
+
+    def _get_matchers(self):
+        stamp = self.source.config_stamp()
+        if self._matchers is None or stamp != self._matchers_stamp:
+            self.send_progress("- Parsing .gitignore and .gitattributes...")
+            self._matchers = self.source.get_matchers()
+            self._matchers_stamp = stamp
+        return self._matchers
+
+    def _get_preset_patterns(self) -> list:
+        stamp = tuple(_mtime_ns(resolve_preset_path(name)) for name in self.selected_presets)
+        if self._preset_patterns is None or stamp != self._presets_stamp:
+            if self.selected_presets:
+                self.send_progress("- Loading presets...")
+            self._preset_patterns = load_presets(self.selected_presets)
+            self._presets_stamp = stamp
+        return self._preset_patterns
+
+    def tree(self) -> str:
+        """
+        Строит дерево проекта с учетом исключений и пресетов.
+        """
+        self._check_source()
+        gitignore_matcher, gitattributes_matcher = self._get_matchers()
+        preset_patterns = self._get_preset_patterns()
+        all_excluded_folders = DEFAULT_IGNORE_PATTERNS + self.exclude_folders + [p for p in preset_patterns if '/' in p or '*' in p or '.' in p]
+        # Примечание: Мы добавляем все паттерны из пресетов в список исключений. 
+        # Для простоты пока будем проверять их через fnmatch или простое вхождение, 
+        # так как текущая архитектура полагается на список строк для папок.
+        self.send_progress("- Building project tree...")
+        return self.source.tree(
+            all_excluded_folders, gitignore_matcher, gitattributes_matcher,
+            max_depth=self.tree_depth, max_entries=self.tree_max_entries
+        )
+
+    def files(self) -> list:
+        """
+        Возвращает отфильтрованный список файлов (SourceEntry). Если правила
+        и состав папок не менялись, повторно используется последний обход.
+        """
+        self._check_source()
+        gitignore_matcher, gitattributes_matcher = self._get_matchers()
+        preset_patterns = self._get_preset_patterns()
+        stamp = (self._matchers_stamp, self._presets_stamp)
+        if self._files is not None and stamp == self._files_stamp and self.source.is_scan_current(self._scan_state):
+            self._files = self.source.refresh_entries(self._files)
+            return self._files
+
+        self.send_progress("- Finding files...")
+        self._files = collect_files(
+            self.source, self.include_ext, self.include_files, self.exclude_folders,
+            self.exclude_files, self.exclude_ext, preset_patterns,
+            gitignore_matcher, gitattributes_matcher
+        )
+        self._scan_state = self.source.scan_state()
+        self._files_stamp = stamp
+        return self._files
+
+    def render(self, query: str = None, budget: int = None, delta_from: dict = None) -> str:
+        """
+        Собирает полный контекст: дерево (если включено) и содержимое файлов.
+        Если задан query, файлы ранжируются по BM25 и в вывод попадают только
+        релевантные, пока их суммарный размер укладывается в budget (символы).
+        max_total_chars ограничивает суммарный объем содержимого: после его
+        достижения файлы больше не читаются и перечисляются в конце как пропущенные.
+        Если передан delta_from (файлы из манифеста прошлого запуска), выдаются
+        только добавленные и измененные файлы и список удаленных.
+        Манифест выданных файлов этого запуска сохраняется в self.last_manifest;
+        файлы, обрезанные общим лимитом, в него не попадают.
+        """
+        output_parts = []
+        if self.include_tree:
+            output_parts.append("Project file structure:\n=======================\n```\n" + self.tree() + "\n```\n")
+
+        output_parts.append("File contents:\n==============")
+        all_entries = self.files()
+        final_entries = all_entries
+        manifest = {}
+        deleted_files = []
+        if delta_from is not None:
+            current_paths = {entry.path for entry in all_entries}
+            deleted_files = sorted(str(Path(p)) for p in delta_from if p not in current_paths)
+            # Файлы с теми же размером и меткой изменения не читаются и не хэшируются
+            changed_entries = []
+            for entry in all_entries:
+                previous = delta_from.get(entry.path)
+                if previous and previous["size"] == entry.size and previous["mtime"] == entry.mtime:
+                    manifest[entry.path] = previous
+                else:
+                    changed_entries.append(entry)
+            self.send_progress(f"- Delta: {len(changed_entries)} changed or new, {len(deleted_files)} deleted")
+            final_entries = changed_entries
+        if query:
+            # Индекс обновляется по всем файлам, дельта только сужает выбор
+            final_entries = select_relevant_files(
+                self.source, all_entries, query, budget, self.max_chars_per_file, self.send_progress,
+                candidates=final_entries
+            )
+
+        max_chars_per_file = self.max_chars_per_file
+        max_total_chars = self.max_total_chars
+        total_files = len(final_entries)
+        total_chars = 0
+        omitted_files = []
+        # Чтение ленивое: после исчерпания общего лимита следующие файлы не открываются.
+        # Источник может отдавать файлы не в запрошенном порядке (tar читается потоково).
+        pending = {entry.path: entry for entry in final_entries}
+        limit_reached = max_total_chars is not None and max_total_chars <= 0
+        contents = self.source.read_texts(list(pending), max_chars_per_file + 1)
+        if not limit_reached:
+            for i, (rel_path_str, content, error) in enumerate(contents):
+                entry = pending.pop(rel_path_str)
+                relative_path_str = str(Path(rel_path_str))
+                self.send_progress(f"({i+1}/{total_files}) 📄 {relative_path_str}")
+                if error is not None:
+                    self.send_progress(f"⚠️  Could not read: {relative_path_str} | {error}")
+                    continue
+                digest = content_hash(content)
+                manifest_entry = {"size": entry.size, "mtime": entry.mtime, "hash": digest}
+                if delta_from is not None and delta_from.get(rel_path_str, {}).get("hash") == digest:
+                    # Изменилась только метка времени, содержимое то же
+                    manifest[rel_path_str] = manifest_entry
+                    continue
+                limit = max_chars_per_file
+                if max_total_chars is not None:
+                    limit = min(limit, max_total_chars - total_chars)
+                # Файл, обрезанный общим лимитом, не считается выданным:
+                # иначе следующий --delta-from не отдал бы его остаток
+                if limit == max_chars_per_file or len(content) <= limit:
+                    manifest[rel_path_str] = manifest_entry
+                output_parts.extend(format_file_block(relative_path_str, PurePosixPath(rel_path_str).suffix, content, limit))
+                total_chars += min(len(content), limit)
+                if max_total_chars is not None and total_chars >= max_total_chars:
+                    limit_reached = True
+                    break
+        contents.close()
+        if limit_reached and pending:
+            omitted_files = [str(Path(p)) for p in pending]
+            self.send_progress(f"⚠️  Total size limit reached, {len(omitted_files)} files omitted")
+
+        if omitted_files:
+            output_parts.append("Omitted files (total size limit reached):\n" + "\n".join(f"- {p}" for p in omitted_files))
+        if deleted_files:
+            output_parts.append("Deleted files (since previous manifest):\n" + "\n".join(f"- {p}" for p in deleted_files))
+        self.last_manifest = manifest
+        return "\n".join(output_parts)
+
+    def stats(self, top: int = 15) -> str:
+        """
+        Быстрая оценка размера контекста без чтения содержимого: выполняет только
+        обход и фильтры и считает по размерам файлов (1 байт ≈ 1 символ).
+        Возвращает отчет с разбивкой по папкам верхнего уровня и расширениям.
+        """
+        entries = self.files()
+        max_chars_per_file = self.max_chars_per_file
+        max_total_chars = self.max_total_chars
+
+        total_bytes = 0
+        total_chars = 0
+        truncated_count = 0
+        omitted_count = 0
+        by_dir = {}
+        by_ext = {}
+        for entry in entries:
+            chars = min(entry.size, max_chars_per_file)
+            if max_total_chars is not None:
+                if total_chars >= max_total_chars:
+                    omitted_count += 1
+                    continue
+                chars = min(chars, max_total_chars - total_chars)
+            if entry.size > max_chars_per_file:
+                truncated_count += 1
+            total_bytes += entry.size
+            total_chars += chars
+            rel_path = PurePosixPath(entry.path)
+            dir_key = rel_path.parts[0] + '/' if len(rel_path.parts) > 1 else '.'
+            for groups, key in ((by_dir, dir_key), (by_ext, rel_path.suffix or '(none)')):
+                count, chars_sum = groups.get(key, (0, 0))
+                groups[key] = (count + 1, chars_sum + chars)
+
+        def format_groups(title: str, groups: dict) -> list[str]:
+            lines = [f"{title}:"]
+            ranked = sorted(groups.items(), key=lambda item: (-item[1][1], item[0]))
+            for key, (count, chars) in ranked[:top]:
+                share = chars / total_chars * 100 if total_chars else 0
+                lines.append(f"  {key:<30} {count:>6} files  ~{chars // CHARS_PER_TOKEN:>10,} tokens  {share:5.1f}%")
+            if len(ranked) > top:
+                lines.append(f"  … {len(ranked) - top} more")
+            return lines
+
+        report = [
+            "Context size estimate:",
+            "======================",
+            f"Files: {len(entries) - omitted_count} ({format_size(total_bytes)} on disk)",
+            f"Estimated content: ~{total_chars:,} chars, ~{total_chars // CHARS_PER_TOKEN:,} tokens",
+            f"Truncated by per-file limit: {truncated_count}",
+        ]
+        if max_total_chars is not None:
+            report.append(f"Omitted by total limit: {omitted_count}")
+        report.append("")
+        report.extend(format_groups("By directory", by_dir))
+        report.append("")
+        report.extend(format_groups("By extension", by_ext))
+        return "\n".join(report)
+
+
+def create_llm_context(
+    repo_path_str: str, include_ext: list, include_files: list,
+    exclude_folders: list, exclude_files: list, exclude_ext: list,
+    include_tree: bool, max_chars_per_file: int, progress_callback,
+    selected_presets: list = None, query: str = None, budget: int = None,
+    tree_depth: int = None, tree_max_entries: int = None, max_total_chars: int = None,
+    ref: str = None
+) -> str:
+    """
+    Собирает контекст из репозитория для LLM (разовый запуск ContextBuilder).
+    repo_path_str может указывать на папку или на архив zip/tar.
+    Если задан ref, берется снимок этой git-ревизии, рабочее дерево не трогается.
+    """
+    with ContextBuilder(
+        repo_path_str, include_ext, include_files, exclude_folders, exclude_files, exclude_ext,
+        include_tree=include_tree, max_chars_per_file=max_chars_per_file,
+        selected_presets=selected_presets, tree_depth=tree_depth, tree_max_entries=tree_max_entries,
+        max_total_chars=max_total_chars, ref=ref, progress_callback=progress_callback
+    ) as builder:
+        return builder.render(query=query, budget=budget)
+
+
+def create_context_stats(
+    repo_path_str: str, include_ext: list, include_files: list,
+    exclude_folders: list, exclude_files: list, exclude_ext: list,
+    max_chars_per_file: int, progress_callback, selected_presets: list = None,
+    max_total_chars: int = None, ref: str = None, top: int = 15
+) -> str:
+    """
+    Оценка размера контекста без чтения содержимого (разовый запуск ContextBuilder.stats).
+    """
+    with ContextBuilder(
+        repo_path_str, include_ext, include_files, exclude_folders, exclude_files, exclude_ext,
+        include_tree=False, max_chars_per_file=max_chars_per_file,
+        selected_presets=selected_presets, max_total_chars=max_total_chars,
+        ref=ref, progress_callback=progress_callback
+    ) as builder:
+        return builder.stats(top=top)
+
+
+def format_file_block(relative_path_str: str, suffix: str, content: str, max_chars_per_file: int) -> list[str]:
+    """
+    Форматирует содержимое одного файла в блок вывода, обрезая его по лимиту.
+    """
+    truncated = False
+    if len(content) > max_chars_per_file:
+        content, truncated = content[:max_chars_per_file], True
+    lang = suffix.lstrip('.') if suffix else 'text'
+    parts = [f"--- START OF FILE: {relative_path_str} ---", f"```{lang}\n{content.strip()}"]
+    if truncated:
+        parts.append("\n\n[... content truncated due to size limit ...]")
+    parts.append(f"```\n--- END OF FILE: {relative_path_str} ---\n")
+    return parts
+
+
+def select_relevant_files(
+    source, entries: list, query: str, budget: int,
+    max_chars_per_file: int, send_progress, candidates: list = None
+) -> list:
+    """
+    Обновляет индекс релевантности по entries и возвращает файлы, отсортированные
+    по BM25, которые помещаются в бюджет символов (если он задан).
+    candidates (по умолчанию entries) ограничивает, из каких файлов выбирать.
+    """
+    send_progress("- Updating relevance index...")
+    index = RelevanceIndex.load(get_index_path(source.cache_key))
+    reindexed = index.update(entries, source.read_texts, source.exists, send_progress)
+    index.save()
+    send_progress(f"- Indexed {len(index.docs)} files ({reindexed} updated)")
+
+    by_rel_path = {entry.path: entry for entry in (entries if candidates is None else candidates)}
+    selected = []
+    used = 0
+    for rel_path_str, score in index.search(query, by_rel_path):
+        size = min(index.docs[rel_path_str]["chars"], max_chars_per_file)
+        if budget is not None and used + size > budget:
             continue
-        final_file_list.append(file_path)
-
-    total_files = len(final_file_list)
-    for i, file_path in enumerate(final_file_list):
-        relative_path_str = str(file_path.relative_to(repo_path))
-        send_progress(f"({i+1}/{total_files}) 📄 {relative_path_str}")
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read(max_chars_per_file + 1)
-            truncated = False
-            if len(content) > max_chars_per_file:
-                content, truncated = content[:max_chars_per_file], True
-            lang = file_path.suffix.lstrip('.') if file_path.suffix else 'text'
-            output_parts.append(f"--- START OF FILE: {relative_path_str} ---")
-            output_parts.append(f"```{lang}\n{content.strip()}")
-            if truncated:
-                output_parts.append("\n\n[... content truncated due to size limit ...]")
-            output_parts.append(f"```\n--- END OF FILE: {relative_path_str} ---\n")
-        except Exception as e:
-            send_progress(f"⚠️  Could not read: {relative_path_str} | {e}")
-    return "\n".join(output_parts)
+        used += size
+        selected.append(by_rel_path[rel_path_str])
+    send_progress(f"- Selected {len(selected)} relevant files (~{used:,} chars)")
+    return selected
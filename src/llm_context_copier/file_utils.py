@@ -1,11 +1,25 @@
 import fnmatch
+import os
+import re
 from pathlib import Path
-from gitignore_parser import parse_gitignore
+from gitignore_parser import parse_gitignore, parse_gitignore_str
 
-def get_gitignore_matcher(base_path: Path):
+# Сколько скрытых файлов в свернутой строке дерева опрашивается для оценки размера
+FOLDED_SIZE_SAMPLE = 1000
+
+def get_gitignore_matcher(base_path: Path, content: str = None):
     """
     Создает функцию-матчер на основе правил из файла .gitignore.
+    Если передан content, правила берутся из него, а не из файла на диске
+    (так работают источники без распаковки, например архивы).
     """
+    if content is not None:
+        try:
+            return parse_gitignore_str(content, base_path)
+        except Exception as e:
+            print(f"Warning: Could not parse .gitignore file: {e}")
+        return lambda p: False
+
     gitignore_path = base_path / '.gitignore'
     if gitignore_path.is_file():
         try:
@@ -15,34 +29,42 @@ def get_gitignore_matcher(base_path: Path):
     return lambda p: False
 
 
-def get_gitattributes_matcher(base_path: Path):
+def _parse_gitattributes_rules(lines) -> list:
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        pattern = parts[0]
+        attributes = parts[1:]
+        is_ignore_rule = None
+        for attr in attributes:
+            if attr in ("linguist-generated", "linguist-generated=true", "linguist-vendored", "linguist-vendored=true"):
+                is_ignore_rule = True
+            elif attr in ("-linguist-generated", "linguist-generated=false", "-linguist-vendored", "linguist-vendored=false"):
+                is_ignore_rule = False
+        if is_ignore_rule is not None:
+            rules.append((pattern, is_ignore_rule))
+    return rules
+
+
+def get_gitattributes_matcher(base_path: Path, content: str = None):
     """
     Создает функцию-матчер на основе правил linguist-* из .gitattributes.
+    Если передан content, правила берутся из него, а не из файла на диске.
     """
-    gitattributes_path = base_path / '.gitattributes'
-    if not gitattributes_path.is_file():
-        return lambda p: False
-
-    rules = []
     try:
-        with open(gitattributes_path, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                parts = line.split()
-                if len(parts) < 2:
-                    continue
-                pattern = parts[0]
-                attributes = parts[1:]
-                is_ignore_rule = None
-                for attr in attributes:
-                    if attr in ("linguist-generated", "linguist-generated=true", "linguist-vendored", "linguist-vendored=true"):
-                        is_ignore_rule = True
-                    elif attr in ("-linguist-generated", "linguist-generated=false", "-linguist-vendored", "linguist-vendored=false"):
-                        is_ignore_rule = False
-                if is_ignore_rule is not None:
-                    rules.append((pattern, is_ignore_rule))
+        if content is not None:
+            rules = _parse_gitattributes_rules(content.splitlines())
+        else:
+            gitattributes_path = base_path / '.gitattributes'
+            if not gitattributes_path.is_file():
+                return lambda p: False
+            with open(gitattributes_path, 'r', encoding='utf-8', errors='ignore') as f:
+                rules = _parse_gitattributes_rules(f)
     except Exception as e:
         print(f"Warning: Could not parse .gitattributes file: {e}")
         return lambda p: False
@@ -74,46 +96,246 @@ def get_gitattributes_matcher(base_path: Path):
     return matcher
 
 
-def get_project_structure(root_path: Path, ignored_patterns: list, gitignore_matcher, gitattributes_matcher) -> str:
+def _dir_key(path) -> tuple:
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino)
+
+
+def _is_inside(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def walk_files(root_path: Path, prune_dir=None, want_file=None, dir_mtimes: dict = None):
+    """
+    Обходит дерево и возвращает файлы (os.DirEntry). Симлинки на папки раскрываются,
+    только если их цель лежит внутри root_path, и каждая папка и каждый файл
+    (по паре device, inode) посещается один раз, поэтому ссылки не уводят за
+    пределы репозитория, а циклы и дубликаты не приводят к повторному чтению.
+    prune_dir(name) позволяет не заходить в исключенные папки,
+    want_file(name, rel_path_str) — сразу отбросить ненужные файлы
+    (rel_path_str — posix-путь относительно root_path).
+    Если передан dir_mtimes, в него записываются mtime всех обойденных папок.
+    """
+    try:
+        root_st = os.stat(root_path)
+    except OSError:
+        return
+    visited_dirs = {(root_st.st_dev, root_st.st_ino)}
+    if dir_mtimes is not None:
+        dir_mtimes[str(root_path)] = root_st.st_mtime_ns
+    real_root = os.path.realpath(root_path)
+    visited_files = set()
+    stack = [(root_path, root_st.st_dev, "")]
+    while stack:
+        current_path, current_dev, rel_dir = stack.pop()
+        try:
+            with os.scandir(current_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except (OSError, PermissionError):
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                is_symlink = entry.is_symlink()
+                if entry.is_dir():
+                    if prune_dir and prune_dir(entry.name):
+                        continue
+                    if is_symlink and not _is_inside(os.path.realpath(entry.path), real_root):
+                        continue
+                    st = entry.stat()
+                    key = (st.st_dev, st.st_ino)
+                    if key not in visited_dirs:
+                        visited_dirs.add(key)
+                        if dir_mtimes is not None:
+                            dir_mtimes[entry.path] = st.st_mtime_ns
+                        subdirs.append((Path(entry.path), st.st_dev, rel_dir + entry.name + '/'))
+                    continue
+                if not entry.is_file() or (want_file and not want_file(entry.name, rel_dir + entry.name)):
+                    continue
+                if is_symlink:
+                    st = entry.stat()
+                    key = (st.st_dev, st.st_ino)
+                else:
+                    # Обычный файл лежит на том же устройстве, что и его папка
+                    key = (current_dev, entry.inode())
+            except OSError:
+                continue
+            if key in visited_files:
+                continue
+            visited_files.add(key)
+            yield entry
+        stack.extend(reversed(subdirs))
+
+
+def format_size(size: int) -> str:
     """
-    Строит строковое представление дерева проекта.
+    Форматирует размер в байтах в человекочитаемый вид.
     """
-    tree_lines = []
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
 
-    def is_ignored(item: Path) -> bool:
-        if gitignore_matcher(item) or gitattributes_matcher(item):
+def make_tree_ignore_checker(root_path: Path, ignored_patterns: list, gitignore_matcher, gitattributes_matcher):
+    """
+    Возвращает функцию is_ignored(rel_path_str, name), которая проверяет,
+    скрыт ли элемент в дереве. Проверяются только имя и путь самого элемента:
+    в скрытые папки дерево не заходит, поэтому предков проверять не нужно.
+    Сначала идут дешевые проверки имени, матчеры .gitignore/.gitattributes — последними.
+    """
+    literal_names = {p for p in ignored_patterns if not any(c in p for c in "*?[")}
+    flags = re.IGNORECASE if os.path.normcase("A") != "A" else 0
+    combined = "|".join(f"(?:{fnmatch.translate(p)})" for p in ignored_patterns)
+    match_pattern = re.compile(combined, flags).match if combined else None
+
+    def is_ignored(rel_path_str: str, name: str) -> bool:
+        if name in literal_names:
             return True
-        
-        rel_path = item.relative_to(root_path)
-        rel_path_str = rel_path.as_posix()
-        
-        # Простая проверка по частям пути
-        if any(part in ignored_patterns for part in rel_path.parts):
+        if match_pattern and (match_pattern(name) or match_pattern(rel_path_str)):
             return True
-        
-        # Проверка через fnmatch для паттернов из пресетов
-        for pattern in ignored_patterns:
-            if fnmatch.fnmatch(rel_path_str, pattern) or \
-               fnmatch.fnmatch(item.name, pattern) or \
-               any(fnmatch.fnmatch(p, pattern) for p in rel_path.parts):
-                return True
-        return False
-
-    def recurse(current_path: Path, prefix: str = ""):
-        try:
-            items = sorted(list(current_path.iterdir()), key=lambda p: (p.is_file(), p.name.lower()))
-        except (OSError, PermissionError):
-            return
+        item = root_path / rel_path_str
+        return bool(gitignore_matcher(item) or gitattributes_matcher(item))
+    return is_ignored
+
+
+def render_tree(root_name: str, root_node, list_children, max_depth: int = None, max_entries: int = None) -> str:
+    """
+    Рисует дерево. list_children(node) возвращает отсортированный список
+    (имя, это_папка, узел_для_раскрытия_или_None, функция_размера).
+    max_depth ограничивает глубину вложенности, а max_entries — число строк
+    на одну папку: остальные элементы сворачиваются в одну итоговую строку.
+    """
+    tree_lines = [f"{root_name}"]
+
+    def folded_summary(hidden: list) -> str:
+        dir_count = sum(1 for _, is_dir, _, _ in hidden if is_dir)
+        file_count = len(hidden) - dir_count
+        # Размер считается по выборке: stat каждого скрытого файла свел бы сворачивание на нет
+        total_size = 0
+        sampled = 0
+        for _, is_dir, _, get_size in hidden:
+            if is_dir:
+                continue
+            if sampled >= FOLDED_SIZE_SAMPLE:
+                break
+            sampled += 1
+            try:
+                total_size += get_size()
+            except OSError:
+                pass
+        parts = []
+        if dir_count:
+            parts.append(f"{dir_count} more dirs")
+        if file_count:
+            if sampled < file_count:
+                size_str = "~" + format_size(total_size / sampled * file_count)
+            else:
+                size_str = format_size(total_size)
+            parts.append(f"{file_count} more files ({size_str})")
+        return "… " + ", ".join(parts)
+
+    def recurse(node, prefix: str = "", depth: int = 0):
+        valid_items = list_children(node)
+        hidden_items = []
+        if max_entries is not None and len(valid_items) > max_entries:
+            valid_items, hidden_items = valid_items[:max_entries], valid_items[max_entries:]
 
-        valid_items = [item for item in items if not is_ignored(item)]
-        for i, item in enumerate(valid_items):
-            is_last = i == (len(valid_items) - 1)
+        for i, (name, is_dir, child, _) in enumerate(valid_items):
+            is_last = i == (len(valid_items) - 1) and not hidden_items
             connector = "└── " if is_last else "├── "
-            tree_lines.append(f"{prefix}{connector}{item.name}")
-            if item.is_dir():
+            tree_lines.append(f"{prefix}{connector}{name}")
+            if is_dir and child is not None and (max_depth is None or depth + 1 < max_depth):
                 new_prefix = prefix + ("    " if is_last else "│   ")
-                recurse(item, new_prefix)
+                recurse(child, new_prefix, depth + 1)
+        if hidden_items:
+            tree_lines.append(f"{prefix}└── {folded_summary(hidden_items)}")
 
-    tree_lines.append(f"{root_path.name}")
-    recurse(root_path)
+    recurse(root_node)
     return "\n".join(tree_lines)
+
+
+def get_project_structure(
+    root_path: Path, ignored_patterns: list, gitignore_matcher, gitattributes_matcher,
+    max_depth: int = None, max_entries: int = None
+) -> str:
+    """
+    Строит строковое представление дерева проекта на диске.
+    """
+    is_ignored = make_tree_ignore_checker(root_path, ignored_patterns, gitignore_matcher, gitattributes_matcher)
+    visited_dirs = set()
+    real_root = os.path.realpath(root_path)
+
+    def list_children(node_info) -> list:
+        current_path, rel_dir = node_info
+        # Защита от циклов через симлинки: каждая папка раскрывается один раз
+        try:
+            key = _dir_key(current_path)
+        except OSError:
+            return []
+        if key in visited_dirs:
+            return []
+        visited_dirs.add(key)
+
+        # Тип элемента берется из DirEntry (d_type), без отдельного stat на каждый файл
+        items = []
+        try:
+            with os.scandir(current_path) as it:
+                for entry in it:
+                    rel_path_str = rel_dir + entry.name
+                    if is_ignored(rel_path_str, entry.name):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        # Симлинк на папку вне корня показывается, но не раскрывается
+                        expand = is_dir and not (
+                            entry.is_symlink() and not _is_inside(os.path.realpath(entry.path), real_root)
+                        )
+                    except OSError:
+                        is_dir = expand = False
+                    child = (entry.path, rel_path_str + '/') if expand else None
+                    items.append((entry.name, is_dir, child, lambda e=entry: e.stat().st_size))
+        except (OSError, PermissionError):
+            return []
+        items.sort(key=lambda i: (not i[1], i[0].lower()))
+        return items
+
+    return render_tree(root_path.name, (root_path, ""), list_children, max_depth, max_entries)
+
+
+def get_paths_structure(
+    root_name: str, root_path: Path, files: dict, ignored_patterns: list,
+    gitignore_matcher, gitattributes_matcher, max_depth: int = None, max_entries: int = None
+) -> str:
+    """
+    Строит дерево по списку путей без обращения к диску (архивы, git-ревизии).
+    files — словарь {относительный posix-путь: размер}; root_path используется
+    только как база для матчеров.
+    """
+    is_ignored = make_tree_ignore_checker(root_path, ignored_patterns, gitignore_matcher, gitattributes_matcher)
+    tree = {}
+    for rel_path_str, size in files.items():
+        *dir_parts, name = rel_path_str.split('/')
+        node = tree
+        for part in dir_parts:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        node.setdefault(name, size)
+
+    def list_children(node_info) -> list:
+        rel_dir, node = node_info
+        items = []
+        for name, child in node.items():
+            rel_path_str = rel_dir + name
+            if is_ignored(rel_path_str, name):
+                continue
+            if isinstance(child, dict):
+                items.append((name, True, (rel_path_str + '/', child), None))
+            else:
+                items.append((name, False, None, lambda size=child: size))
+        items.sort(key=lambda i: (not i[1], i[0].lower()))
+        return items
+
+    return render_tree(root_name, ("", tree), list_children, max_depth, max_entries)
@@ -11,8 +11,8 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import QThread, QObject, pyqtSignal, Qt, QSettings
 from PyQt6.QtGui import QDragEnterEvent, QDropEvent
 
-from .context_generator import create_llm_context, DEFAULT_IGNORE_PATTERNS, load_presets
-from .file_utils import get_project_structure, get_gitignore_matcher, get_gitattributes_matcher
+from .context_generator import ContextBuilder
+from .sources import is_archive
 
 
 class Worker(QObject):
@@ -20,25 +20,15 @@ class Worker(QObject):
     error = pyqtSignal(str)
     progress = pyqtSignal(str)
 
-    def __init__(self, repo_path, include_ext, include_files, exclude_folders, exclude_files, exclude_ext, include_tree, max_chars, selected_presets):
+    def __init__(self, builder, stats_only=False):
         super().__init__()
-        self.repo_path = repo_path
-        self.include_ext = include_ext
-        self.include_files = include_files
-        self.exclude_folders = exclude_folders
-        self.exclude_files = exclude_files
-        self.exclude_ext = exclude_ext
-        self.include_tree = include_tree
-        self.max_chars = max_chars
-        self.selected_presets = selected_presets
+        self.builder = builder
+        self.stats_only = stats_only
 
     def run(self):
         try:
-            result = create_llm_context(
-                self.repo_path, self.include_ext, self.include_files, self.exclude_folders,
-                self.exclude_files, self.exclude_ext, self.include_tree, self.max_chars, self.progress,
-                self.selected_presets
-            )
+            self.builder.progress_callback = self.progress
+            result = self.builder.stats() if self.stats_only else self.builder.render()
             self.finished.emit(result)
         except Exception as e:
             self.error.emit(str(e))
@@ -55,13 +45,15 @@ class App(QMainWindow):
         self.load_settings()
         self.thread = None
         self.worker = None
+        self.builder = None
+        self.builder_key = None
 
     def initUI(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
 
-        path_group = QGroupBox("1. Укажите или перетащите папку проекта")
+        path_group = QGroupBox("1. Укажите или перетащите папку проекта (или архив zip/tar)")
         path_layout = QHBoxLayout()
         self.path_edit = QComboBox()
         self.path_edit.setEditable(True)
@@ -129,8 +121,12 @@ class App(QMainWindow):
         self.tree_button = QPushButton("📋 Только дерево в буфер")
         self.tree_button.setStyleSheet("font-size: 14px; padding: 10px;")
         self.tree_button.clicked.connect(self.generate_tree_only)
+        self.stats_button = QPushButton("📊 Оценить размер")
+        self.stats_button.setStyleSheet("font-size: 14px; padding: 10px;")
+        self.stats_button.clicked.connect(self.run_stats)
         action_layout.addWidget(self.run_button)
         action_layout.addWidget(self.tree_button)
+        action_layout.addWidget(self.stats_button)
         action_group.setLayout(action_layout)
 
         log_group = QGroupBox("Лог выполнения")
@@ -172,10 +168,11 @@ class App(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Готов к работе.")
 
-    def run_processing(self):
-        repo_path = self.validate_path()
-        if not repo_path:
-            return
+    def get_builder(self, repo_path):
+        """
+        Возвращает ContextBuilder для текущих настроек. Пока путь и настройки
+        не меняются, используется один и тот же объект с его кэшами.
+        """
         include_ext = ['*'] if self.include_all_checkbox.isChecked() else self.ext_edit.text().split()
         include_files = self.include_files_edit.text().split()
         exclude_folders = self.exclude_folders_edit.text().split()
@@ -190,19 +187,64 @@ class App(QMainWindow):
             if item.checkState() == Qt.CheckState.Checked:
                 selected_presets.append(item.data(Qt.ItemDataRole.UserRole))
 
-        self.update_path_history(repo_path)
-        self.log_text.clear()
-        self.log_text.append("🚀 Запускаю полную обработку...")
+        key = (
+            repo_path, tuple(include_ext), tuple(include_files), tuple(exclude_folders),
+            tuple(exclude_files), tuple(exclude_ext), include_tree, max_chars, tuple(selected_presets)
+        )
+        if self.builder is None or key != self.builder_key:
+            self.close_builder()
+            self.builder = ContextBuilder(
+                repo_path, include_ext, include_files, exclude_folders, exclude_files, exclude_ext,
+                include_tree=include_tree, max_chars_per_file=max_chars, selected_presets=selected_presets
+            )
+            self.builder_key = key
+        return self.builder
+
+    def close_builder(self):
+        if self.builder is not None:
+            self.builder.close()
+            self.builder = None
+            self.builder_key = None
+
+    def start_worker(self, worker, on_finished):
         self.set_ui_enabled(False)
         self.thread = QThread()
-        self.worker = Worker(repo_path, include_ext, include_files, exclude_folders, exclude_files, exclude_ext, include_tree, max_chars, selected_presets)
+        self.worker = worker
         self.worker.moveToThread(self.thread)
         self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.on_finished)
+        self.worker.finished.connect(on_finished)
         self.worker.error.connect(self.on_error)
         self.worker.progress.connect(lambda msg: self.log_text.append(msg))
         self.thread.start()
 
+    def run_processing(self):
+        repo_path = self.validate_path()
+        if not repo_path:
+            return
+        self.update_path_history(repo_path)
+        self.log_text.clear()
+        self.log_text.append("🚀 Запускаю полную обработку...")
+        try:
+            builder = self.get_builder(repo_path)
+        except Exception as e:
+            self.on_error(str(e))
+            return
+        self.start_worker(Worker(builder), self.on_finished)
+
+    def run_stats(self):
+        repo_path = self.validate_path()
+        if not repo_path:
+            return
+        self.update_path_history(repo_path)
+        self.log_text.clear()
+        self.log_text.append("📊 Оцениваю размер контекста...")
+        try:
+            builder = self.get_builder(repo_path)
+        except Exception as e:
+            self.on_error(str(e))
+            return
+        self.start_worker(Worker(builder, stats_only=True), self.on_stats_finished)
+
     def load_settings(self):
         history = self.settings.value("path_history", [])
         if isinstance(history, str):  # QSettings sometimes returns a single string if only one item
@@ -275,8 +317,8 @@ class App(QMainWindow):
 
     def validate_path(self):
         repo_path = self.path_edit.currentText()
-        if not repo_path or not Path(repo_path).is_dir():
-            self.status_bar.showMessage("❌ Ошибка: Укажите корректный путь к папке проекта.")
+        if not repo_path or not (Path(repo_path).is_dir() or is_archive(Path(repo_path))):
+            self.status_bar.showMessage("❌ Ошибка: Укажите корректный путь к папке проекта или архиву.")
             return None
         return repo_path
 
@@ -284,24 +326,13 @@ class App(QMainWindow):
         repo_path_str = self.validate_path()
         if not repo_path_str:
             return
-        repo_path = Path(repo_path_str)
         self.log_text.clear()
         self.log_text.append("🌳 Генерирую только дерево файлов...")
-        exclude_folders = self.exclude_folders_edit.text().split()
-        
-        selected_presets = []
-        for i in range(self.presets_list.count()):
-            item = self.presets_list.item(i)
-            if item.checkState() == Qt.CheckState.Checked:
-                selected_presets.append(item.data(Qt.ItemDataRole.UserRole))
-        
-        preset_patterns = load_presets(selected_presets)
-        all_exclusions = DEFAULT_IGNORE_PATTERNS + exclude_folders + preset_patterns
         
         try:
-            gitignore_matcher = get_gitignore_matcher(repo_path)
-            gitattributes_matcher = get_gitattributes_matcher(repo_path)
-            tree = get_project_structure(repo_path, all_exclusions, gitignore_matcher, gitattributes_matcher)
+            builder = self.get_builder(repo_path_str)
+            builder.progress_callback = None
+            tree = builder.tree()
             pyperclip.copy(tree)
             self.log_text.append("\n" + tree)
             self.log_text.append(f"\n✅ Дерево проекта скопировано в буфер обмена ({len(tree):,} символов).")
@@ -332,6 +363,11 @@ class App(QMainWindow):
             self.status_bar.showMessage(f"✅ Готово! Скопировано ({full_message}).")
         self.cleanup_thread()
 
+    def on_stats_finished(self, report):
+        self.log_text.append("\n" + report)
+        self.status_bar.showMessage("✅ Оценка размера готова.")
+        self.cleanup_thread()
+
     def on_error(self, error_message):
         self.log_text.append(f"\n❌ Произошла ошибка: {error_message}")
         self.status_bar.showMessage(f"❌ Ошибка: {error_message}")
@@ -345,7 +381,7 @@ class App(QMainWindow):
 
     def set_ui_enabled(self, enabled):
         widgets_to_toggle = [
-            self.run_button, self.tree_button, self.path_edit, self.ext_edit,
+            self.run_button, self.tree_button, self.stats_button, self.path_edit, self.ext_edit,
             self.include_files_edit, self.exclude_folders_edit,
             self.exclude_files_edit, self.exclude_ext_edit, self.limit_spinbox,
             self.tree_checkbox, self.exact_tokens_checkbox, self.include_all_checkbox
@@ -355,6 +391,7 @@ class App(QMainWindow):
 
     def closeEvent(self, event):
         self.save_settings()
+        self.close_builder()
         super().closeEvent(event)
 
     def dragEnterEvent(self, event: QDragEnterEvent):
@@ -367,7 +404,7 @@ class App(QMainWindow):
         urls = event.mimeData().urls()
         if urls:
             path = urls[0].toLocalFile()
-            if os.path.isdir(path):
+            if os.path.isdir(path) or is_archive(Path(path)):
                 self.path_edit.setCurrentText(path)
             else:
-                self.status_bar.showMessage("❌ Пожалуйста, перетащите папку, а не файл.")
+                self.status_bar.showMessage("❌ Пожалуйста, перетащите папку или архив (zip/tar).")
@@ -0,0 +1,36 @@
+import hashlib
+import json
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def load_manifest(manifest_path: Path, expected_source: str = None) -> dict:
+    """
+    Загружает манифест предыдущего запуска. Возвращает словарь
+    {относительный posix-путь: {"size", "mtime", "hash"}}.
+    Если передан expected_source, манифест должен быть записан для того же
+    источника (cache_key), иначе дельта сравнивала бы разные деревья.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version in {manifest_path}: {data.get('version')}")
+    if expected_source is not None and data.get("source") != expected_source:
+        raise ValueError(
+            f"Manifest {manifest_path} was written for {data.get('source')!r}, not {expected_source!r}"
+        )
+    return data.get("files", {})
+
+
+def save_manifest(manifest_path: Path, files: dict, source_key: str = None):
+    """
+    Сохраняет манифест выданных файлов с хэшами содержимого.
+    """
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "source": source_key, "files": files}, f, indent=1, sort_keys=True)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+CACHE_DIR = Path.home() / ".repo_copier_cache"
+INDEX_VERSION = 1
+# Сколько символов файла попадает в индекс. Больше обычно не нужно для ранжирования.
+INDEX_MAX_CHARS = 1_000_000
+# Совпадение в пути весит больше, чем в содержимом.
+PATH_WEIGHT = 3
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Разбивает текст на термы: целые идентификаторы плюс их части
+    (snake_case и camelCase), всё в нижнем регистре.
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        if len(word) < 2:
+            continue
+        lower = word.lower()
+        tokens.append(lower)
+        parts = [p for chunk in word.split('_') for p in _CAMEL_RE.findall(chunk)]
+        if len(parts) > 1:
+            tokens.extend(p.lower() for p in parts if len(p) > 1)
+    return tokens
+
+
+def get_index_path(cache_key: str) -> Path:
+    """
+    Возвращает путь к файлу индекса для источника в каталоге кэша.
+    """
+    digest = hashlib.sha1(cache_key.encode('utf-8')).hexdigest()[:16]
+    return CACHE_DIR / f"{digest}.index.json"
+
+
+class RelevanceIndex:
+    """
+    Инвертированный индекс по путям, идентификаторам и содержимому файлов
+    с ранжированием BM25. Хранится на диске и обновляется по mtime.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        # rel_path -> {"mtime", "size", "chars", "length", "terms": {term: tf}}
+        self.docs = {}
+        self._postings = None
+        self._dirty = False
+
+    @classmethod
+    def load(cls, index_path: Path) -> "RelevanceIndex":
+        index = cls(index_path)
+        if index_path.is_file():
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    index.docs = data.get("docs", {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not load relevance index: {e}")
+        return index
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": INDEX_VERSION, "docs": self.docs}, f)
+            tmp_path.replace(self.index_path)
+            self._dirty = False
+        except OSError as e:
+            print(f"Warning: Could not save relevance index: {e}")
+
+    def update(self, entries: list, read_texts, exists, progress=None) -> int:
+        """
+        Обновляет индекс по списку файлов (SourceEntry): переиндексирует
+        изменённые по mtime/размеру. Документы вне списка сохраняются, пока
+        файл существует в источнике (exists(path)), — другой набор фильтров
+        не должен стирать индекс. read_texts(paths, max_chars) — функция чтения
+        источника. Возвращает число прочитанных файлов.
+        """
+        stale = {}
+        for entry in entries:
+            doc = self.docs.get(entry.path)
+            if not (doc and doc["mtime"] == entry.mtime and doc["size"] == entry.size):
+                stale[entry.path] = entry
+
+        listed = {entry.path for entry in entries}
+        removed = [p for p in self.docs if p not in listed and not exists(p)]
+        for rel_path_str in removed:
+            del self.docs[rel_path_str]
+
+        for rel_path_str, content, error in read_texts(list(stale), INDEX_MAX_CHARS):
+            if error is not None:
+                self.docs.pop(rel_path_str, None)
+                if progress:
+                    progress(f"⚠️  Could not index: {rel_path_str} | {error}")
+                continue
+            self.docs[rel_path_str] = self._make_doc(rel_path_str, content, stale[rel_path_str])
+
+        if stale or removed:
+            self._dirty = True
+            self._postings = None
+        return len(stale)
+
+    @staticmethod
+    def _make_doc(rel_path_str: str, content: str, entry) -> dict:
+        terms = Counter(tokenize(content))
+        for term in tokenize(rel_path_str):
+            terms[term] += PATH_WEIGHT
+        return {
+            "mtime": entry.mtime,
+            "size": entry.size,
+            "chars": len(content),
+            "length": sum(terms.values()),
+            "terms": dict(terms),
+        }
+
+    def _get_postings(self) -> dict:
+        if self._postings is None:
+            postings = {}
+            for rel_path_str, doc in self.docs.items():
+                for term, tf in doc["terms"].items():
+                    postings.setdefault(term, {})[rel_path_str] = tf
+            self._postings = postings
+        return self._postings
+
+    def search(self, query: str, candidates=None) -> list[tuple[str, float]]:
+        """
+        Ранжирует документы по запросу (BM25). Возвращает пары (путь, оценка)
+        только для документов с ненулевой оценкой, по убыванию оценки.
+        candidates ограничивает выдачу, но IDF и средняя длина считаются
+        по всему индексу, поэтому оценки не зависят от фильтров запуска.
+        """
+        total_docs = len(self.docs)
+        if not total_docs:
+            return []
+        postings = self._get_postings()
+        avg_length = sum(doc["length"] for doc in self.docs.values()) / total_docs or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            term_postings = postings.get(term)
+            if not term_postings:
+                continue
+            df = len(term_postings)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for rel_path_str, tf in term_postings.items():
+                if candidates is not None and rel_path_str not in candidates:
+                    continue
+                length = self.docs[rel_path_str]["length"]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[rel_path_str] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
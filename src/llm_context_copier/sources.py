@@ -0,0 +1,450 @@
+import codecs
+import os
+import subprocess
+import tarfile
+import time
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from .file_utils import (
+    get_gitignore_matcher, get_gitattributes_matcher, get_project_structure,
+    get_paths_structure, walk_files
+)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ROOT_CONFIG_FILES = (".gitignore", ".gitattributes")
+CONFIG_MAX_CHARS = 1_000_000
+READ_CHUNK_SIZE = 1 << 20
+
+
+class SourceEntry(NamedTuple):
+    path: str  # относительный posix-путь
+    size: int
+    mtime: float  # метка изменения; для git-ревизий — id blob-объекта
+
+
+def is_archive(path: Path) -> bool:
+    return path.is_file() and path.name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def open_source(path_str: str, ref: str = None):
+    """
+    Открывает источник файлов: папку на диске, архив zip/tar
+    или (если задан ref) снимок git-ревизии без checkout.
+    """
+    path = Path(path_str).resolve()
+    if ref:
+        if not path.is_dir():
+            raise FileNotFoundError(f"Directory not found: {path}")
+        return GitRefSource(path, ref)
+    if path.is_dir():
+        return FileSystemSource(path)
+    if is_archive(path):
+        if path.name.lower().endswith(".zip"):
+            return ZipSource(path)
+        return TarSource(path)
+    raise FileNotFoundError(f"Directory or archive not found: {path}")
+
+
+def _read_text(fileobj, max_chars: int) -> str:
+    # Потоковые объекты tarfile не поддерживают seek, поэтому без TextIOWrapper.
+    # Читается кусками не больше недостающего числа символов (байт не меньше,
+    # чем символов), так что лишнего в памяти почти не бывает.
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    parts = []
+    count = 0
+    while count < max_chars:
+        chunk = fileobj.read(min(max_chars - count, READ_CHUNK_SIZE))
+        if not chunk:
+            parts.append(decoder.decode(b'', final=True))
+            break
+        text = decoder.decode(chunk)
+        parts.append(text)
+        count += len(text)
+    return ''.join(parts)[:max_chars]
+
+
+class _Source:
+    """
+    Базовый класс источника: root_path — база для матчеров, name — корень дерева.
+    """
+
+    def __init__(self, root_path: Path):
+        self.root_path = root_path
+        self.name = root_path.name
+        # Ключ для кэшей на диске (индекс релевантности и т.п.)
+        self.cache_key = str(root_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def source_stamp(self):
+        """
+        Метка самого источника: меняется, когда его нужно открыть заново.
+        """
+        return None
+
+    def config_stamp(self):
+        """
+        Метка состояния .gitignore/.gitattributes: меняется, когда матчеры нужно пересобрать.
+        """
+        return None
+
+    def scan_state(self):
+        """
+        Состояние последнего list_files, по которому можно проверить его актуальность.
+        """
+        return None
+
+    def is_scan_current(self, state) -> bool:
+        return True
+
+    def refresh_entries(self, entries: list) -> list:
+        """
+        Обновляет размеры и метки изменения у ранее найденных файлов.
+        """
+        return entries
+
+
+class FileSystemSource(_Source):
+    """
+    Папка проекта на диске.
+    """
+
+    def __init__(self, root_path: Path):
+        super().__init__(root_path)
+        self._dir_mtimes = {}
+
+    def config_stamp(self):
+        stamp = []
+        for name in ROOT_CONFIG_FILES:
+            try:
+                stamp.append(os.stat(self.root_path / name).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def scan_state(self):
+        return self._dir_mtimes
+
+    def is_scan_current(self, state) -> bool:
+        # Добавление, удаление и переименование файлов меняют mtime папки
+        if not state:
+            return False
+        for dir_path, mtime in state.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def refresh_entries(self, entries: list) -> list:
+        refreshed = []
+        for entry in entries:
+            try:
+                st = os.stat(self.root_path / entry.path)
+            except OSError:
+                continue
+            refreshed.append(entry._replace(size=st.st_size, mtime=st.st_mtime))
+        return refreshed
+
+    def get_matchers(self):
+        return get_gitignore_matcher(self.root_path), get_gitattributes_matcher(self.root_path)
+
+    def exists(self, rel_path_str: str) -> bool:
+        return os.path.isfile(self.root_path / rel_path_str)
+
+    def list_files(self, prune_dir=None, want_file=None) -> list[SourceEntry]:
+        entries = []
+        self._dir_mtimes = {}
+        for entry in walk_files(self.root_path, prune_dir, want_file, self._dir_mtimes):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            rel_path_str = Path(entry.path).relative_to(self.root_path).as_posix()
+            entries.append(SourceEntry(rel_path_str, st.st_size, st.st_mtime))
+        return entries
+
+    def tree(self, ignored_patterns, gitignore_matcher, gitattributes_matcher, max_depth=None, max_entries=None) -> str:
+        return get_project_structure(
+            self.root_path, ignored_patterns, gitignore_matcher, gitattributes_matcher,
+            max_depth=max_depth, max_entries=max_entries
+        )
+
+    def read_texts(self, rel_paths: list, max_chars: int):
+        """
+        Читает файлы по очереди. Возвращает тройки (путь, текст, ошибка).
+        """
+        for rel_path_str in rel_paths:
+            try:
+                with open(self.root_path / rel_path_str, 'r', encoding='utf-8', errors='ignore') as f:
+                    yield rel_path_str, f.read(max_chars), None
+            except Exception as e:
+                yield rel_path_str, None, e
+
+
+class _VirtualSource(_Source):
+    """
+    Источник без папки на диске: список файлов хранится в памяти,
+    а root_path служит только базой для матчеров.
+    Наследники заполняют self.files ({путь: SourceEntry}) и реализуют read_texts.
+    """
+
+    def __init__(self, root_path: Path):
+        super().__init__(root_path)
+        self.files = {}
+
+    def exists(self, rel_path_str: str) -> bool:
+        return rel_path_str in self.files
+
+    def _read_root_configs(self) -> dict:
+        contents = {}
+        present = [name for name in ROOT_CONFIG_FILES if name in self.files]
+        for rel_path_str, content, error in self.read_texts(present, CONFIG_MAX_CHARS):
+            if error is None:
+                contents[rel_path_str] = content
+        return contents
+
+    def get_matchers(self):
+        contents = {name: "" for name in ROOT_CONFIG_FILES}
+        contents.update(self._read_root_configs())
+        return (
+            get_gitignore_matcher(self.root_path, contents[".gitignore"]),
+            get_gitattributes_matcher(self.root_path, contents[".gitattributes"]),
+        )
+
+    def list_files(self, prune_dir=None, want_file=None) -> list[SourceEntry]:
+        entries = []
+        for rel_path_str in sorted(self.files):
+            *dir_parts, name = rel_path_str.split('/')
+            if prune_dir and any(prune_dir(part) for part in dir_parts):
+                continue
+            if want_file and not want_file(name, rel_path_str):
+                continue
+            entries.append(self.files[rel_path_str])
+        return entries
+
+    def tree(self, ignored_patterns, gitignore_matcher, gitattributes_matcher, max_depth=None, max_entries=None) -> str:
+        return get_paths_structure(
+            self.name, self.root_path, {rel: entry.size for rel, entry in self.files.items()},
+            ignored_patterns, gitignore_matcher, gitattributes_matcher,
+            max_depth=max_depth, max_entries=max_entries
+        )
+
+
+class _ArchiveSource(_VirtualSource):
+    """
+    Общая часть источников-архивов. Если все файлы лежат в одной папке
+    верхнего уровня, она считается корнем проекта.
+    """
+
+    def __init__(self, archive_path: Path, members: dict):
+        # members: {имя в архиве: (размер, mtime)}
+        super().__init__(archive_path)
+        self.name = archive_path.name
+        for suffix in ARCHIVE_SUFFIXES:
+            if self.name.lower().endswith(suffix):
+                self.name = self.name[:-len(suffix)]
+                break
+
+        normalized = {}
+        for member_name in members:
+            rel_path_str = member_name.lstrip('/')
+            while rel_path_str.startswith('./'):
+                rel_path_str = rel_path_str[2:]
+            if rel_path_str and '..' not in PurePosixPath(rel_path_str).parts:
+                normalized[member_name] = rel_path_str
+
+        top_dirs = {rel.split('/', 1)[0] for rel in normalized.values()}
+        prefix = ""
+        if len(top_dirs) == 1 and all('/' in rel for rel in normalized.values()):
+            self.name = top_dirs.pop()
+            prefix = self.name + '/'
+
+        self._member_names = {}
+        for member_name, rel_path_str in normalized.items():
+            rel_path_str = rel_path_str[len(prefix):]
+            size, mtime = members[member_name]
+            self.files[rel_path_str] = SourceEntry(rel_path_str, size, mtime)
+            self._member_names[rel_path_str] = member_name
+
+    def source_stamp(self):
+        # Перезапись архива по тому же пути меняет mtime или размер файла
+        try:
+            st = os.stat(self.root_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+
+class ZipSource(_ArchiveSource):
+    """
+    Zip-архив: файлы читаются напрямую через центральный каталог, без распаковки.
+    Архив открывается только на время чтения, чтобы не держать файл
+    (в Windows открытый файл нельзя перезаписать).
+    """
+
+    def __init__(self, archive_path: Path):
+        self._infos = {}
+        members = {}
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                self._infos[info.filename] = info
+                members[info.filename] = (info.file_size, time.mktime(info.date_time + (0, 0, -1)))
+        super().__init__(archive_path, members)
+
+    def read_texts(self, rel_paths: list, max_chars: int):
+        try:
+            zf = zipfile.ZipFile(self.root_path)
+        except (zipfile.BadZipFile, OSError) as e:
+            for rel_path_str in rel_paths:
+                yield rel_path_str, None, e
+            return
+        with zf:
+            for rel_path_str in rel_paths:
+                try:
+                    with zf.open(self._infos[self._member_names[rel_path_str]]) as raw:
+                        yield rel_path_str, _read_text(raw, max_chars), None
+                except Exception as e:
+                    yield rel_path_str, None, e
+
+
+class TarSource(_ArchiveSource):
+    """
+    Tar-архив (в том числе сжатый). Архив читается потоково: один проход
+    для списка файлов (заодно читаются .gitignore/.gitattributes)
+    и по одному проходу на каждый вызов read_texts. Файлы отдаются в порядке
+    архива по мере чтения, а не в запрошенном порядке.
+    """
+
+    def __init__(self, archive_path: Path):
+        members = {}
+        config_texts = {}
+        with tarfile.open(archive_path, 'r|*') as tar:
+            for member in tar:
+                # Ссылки пропускаются: их содержимое и так будет прочитано по основному пути
+                if not member.isfile():
+                    continue
+                members[member.name] = (member.size, float(member.mtime))
+                if PurePosixPath(member.name).name in ROOT_CONFIG_FILES:
+                    config_texts[member.name] = _read_text(tar.extractfile(member), CONFIG_MAX_CHARS)
+        super().__init__(archive_path, members)
+        self._config_texts = config_texts
+
+    def _read_root_configs(self) -> dict:
+        return {
+            name: self._config_texts[self._member_names[name]]
+            for name in ROOT_CONFIG_FILES
+            if name in self._member_names and self._member_names[name] in self._config_texts
+        }
+
+    def read_texts(self, rel_paths: list, max_chars: int):
+        """
+        Читает нужные файлы за один проход по архиву и отдает каждый сразу после
+        чтения, поэтому потребитель может остановиться, не читая остальные.
+        Отсутствующие в архиве файлы отдаются в конце с ошибкой.
+        """
+        wanted = {self._member_names[rel]: rel for rel in rel_paths if rel in self._member_names}
+        done = set()
+        if wanted:
+            try:
+                with tarfile.open(self.root_path, 'r|*') as tar:
+                    for member in tar:
+                        rel_path_str = wanted.get(member.name)
+                        if rel_path_str is None or rel_path_str in done:
+                            continue
+                        done.add(rel_path_str)
+                        try:
+                            content, error = _read_text(tar.extractfile(member), max_chars), None
+                        except Exception as e:
+                            content, error = None, e
+                        yield rel_path_str, content, error
+                        if len(done) == len(wanted):
+                            break
+            except (tarfile.TarError, OSError) as e:
+                for rel_path_str in wanted.values():
+                    if rel_path_str not in done:
+                        done.add(rel_path_str)
+                        yield rel_path_str, None, e
+        for rel_path_str in rel_paths:
+            if rel_path_str not in done:
+                done.add(rel_path_str)
+                yield rel_path_str, None, FileNotFoundError(rel_path_str)
+
+
+class GitRefSource(_VirtualSource):
+    """
+    Снимок git-ревизии: список файлов берется из `git ls-tree -r`, а содержимое
+    читается через один долгоживущий процесс `git cat-file --batch`.
+    Рабочее дерево не затрагивается.
+    """
+
+    def __init__(self, repo_path: Path, ref: str):
+        super().__init__(repo_path)
+        self.ref = ref
+        self.cache_key = f"{repo_path}@{ref}"
+        # ls-tree из папки показывает только ее содержимое, с путями относительно нее
+        result = subprocess.run(
+            ['git', 'ls-tree', '-r', '-l', '-z', ref],
+            cwd=repo_path, capture_output=True
+        )
+        if result.returncode != 0:
+            raise ValueError(f"Cannot read git ref '{ref}': {result.stderr.decode('utf-8', errors='replace').strip()}")
+
+        self._objects = {}
+        for record in result.stdout.split(b'\0'):
+            if not record:
+                continue
+            meta, raw_path = record.split(b'\t', 1)
+            mode, obj_type, obj_id, size = meta.decode('ascii').split()
+            # Симлинки (120000) и сабмодули (commit) пропускаются
+            if obj_type != 'blob' or mode == '120000':
+                continue
+            rel_path_str = raw_path.decode('utf-8', errors='replace')
+            self.files[rel_path_str] = SourceEntry(rel_path_str, int(size), obj_id)
+            self._objects[rel_path_str] = obj_id
+
+        self._process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'], cwd=repo_path,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    def close(self):
+        if self._process.poll() is None:
+            self._process.stdin.close()
+            self._process.wait()
+
+    def _read_blob(self, obj_id: str, max_bytes: int) -> bytes:
+        stdin, stdout = self._process.stdin, self._process.stdout
+        stdin.write(obj_id.encode('ascii') + b'\n')
+        stdin.flush()
+        header = stdout.readline().split()
+        if len(header) < 3:
+            raise FileNotFoundError(f"Object not found: {obj_id}")
+        size = int(header[2])
+        # Объект нужно вычитать из потока целиком, но хранится только начало
+        data = stdout.read(min(size, max_bytes))
+        left = size - len(data)
+        while left > 0:
+            left -= len(stdout.read(min(left, 1 << 20)))
+        stdout.read(1)  # завершающий перевод строки
+        return data
+
+    def read_texts(self, rel_paths: list, max_chars: int):
+        for rel_path_str in rel_paths:
+            try:
+                data = self._read_blob(self._objects[rel_path_str], max_chars * 4)
+                yield rel_path_str, data.decode('utf-8', errors='ignore')[:max_chars], None
+            except (KeyError, OSError, ValueError) as e:
+                yield rel_path_str, None, e
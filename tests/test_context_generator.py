@@ -0,0 +1,141 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from llm_context_copier.context_generator import ContextBuilder
+
+
+def make_project(root):
+    for rel_path_str, content in {
+        "src/main.py": "main\n",
+        "lib/src/main.py": "nested main\n",
+        "main.py": "top main\n",
+        "docs/guide.md": "guide\n",
+        "docs/api/ref.md": "ref\n",
+        "notes.md": "notes\n",
+    }.items():
+        path = root / rel_path_str
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def project_source(kind, tmp_path):
+    root = tmp_path / "proj"
+    make_project(root)
+    if kind == "dir":
+        return str(root), None
+    if kind == "git":
+        if shutil.which("git") is None:
+            pytest.skip("git is not installed")
+        git = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        subprocess.run(git + ["init", "-q"], cwd=root, check=True)
+        subprocess.run(git + ["add", "."], cwd=root, check=True)
+        subprocess.run(git + ["commit", "-q", "-m", "initial"], cwd=root, check=True)
+        return str(root), "HEAD"
+    archive = shutil.make_archive(str(tmp_path / "snapshot"), kind, root_dir=tmp_path, base_dir="proj")
+    return archive, None
+
+
+@pytest.mark.parametrize("kind", ["dir", "zip", "gztar", "git"])
+def test_include_files_with_path_patterns(tmp_path, kind):
+    path, ref = project_source(kind, tmp_path)
+    include_files = ["src/main.py", "docs/*.md"]
+    with ContextBuilder(path, [], include_files, [], [], [], ref=ref) as builder:
+        paths = [entry.path for entry in builder.files()]
+    # Как rglob: путь совпадает с концом относительного пути на любой глубине
+    assert paths == ["docs/guide.md", "lib/src/main.py", "src/main.py"]
+
+
+def test_total_limit_lists_omitted_files(tmp_path):
+    for name in ("a.py", "b.py", "c.py", "d.py"):
+        (tmp_path / name).write_text(name[0] * 10)
+    with ContextBuilder(str(tmp_path), [".py"], [], [], [], [], include_tree=False, max_total_chars=15) as builder:
+        output = builder.render()
+    assert "a" * 10 in output
+    assert "b" * 5 + "\n\n\n[... content truncated due to size limit ...]" in output
+    assert "c" * 10 not in output
+    assert output.endswith("Omitted files (total size limit reached):\n- c.py\n- d.py")
+
+
+def bump_mtime(path):
+    # Явный сдвиг: грубые метки времени ФС могут не измениться между записями
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def cached_builder(tmp_path):
+    root = tmp_path / "proj"
+    (root / "sub").mkdir(parents=True)
+    (root / "keep.py").write_text("keep\n")
+    (root / "skip.py").write_text("skip\n")
+    (root / "sub" / "inner.py").write_text("inner\n")
+    preset = tmp_path / "custom.gitignore"
+    preset.write_text("*.tmp\n")
+    messages = []
+    builder = ContextBuilder(
+        str(root), [".py"], [], [], [], [], selected_presets=[str(preset)], progress_callback=messages.append
+    )
+    yield builder, root, preset, messages
+    builder.close()
+
+
+def scanned(builder, messages) -> tuple:
+    messages.clear()
+    paths = [entry.path for entry in builder.files()]
+    return paths, "- Finding files..." in messages
+
+
+def test_builder_reuses_scan_while_nothing_changed(cached_builder):
+    builder, root, _, messages = cached_builder
+    assert scanned(builder, messages) == (["keep.py", "skip.py", "sub/inner.py"], True)
+    (root / "keep.py").write_text("keep, longer\n")
+    assert scanned(builder, messages) == (["keep.py", "skip.py", "sub/inner.py"], False)
+    assert builder.files()[0].size == len("keep, longer\n")
+
+
+def test_builder_rescans_after_gitignore_change(cached_builder):
+    builder, root, _, messages = cached_builder
+    scanned(builder, messages)
+    (root / ".gitignore").write_text("skip.py\n")
+    assert scanned(builder, messages) == (["keep.py", "sub/inner.py"], True)
+    (root / ".gitignore").write_text("")
+    bump_mtime(root / ".gitignore")
+    assert scanned(builder, messages) == (["keep.py", "skip.py", "sub/inner.py"], True)
+
+
+def test_builder_rescans_after_preset_change(cached_builder):
+    builder, _, preset, messages = cached_builder
+    scanned(builder, messages)
+    preset.write_text("skip.py\n")
+    bump_mtime(preset)
+    assert scanned(builder, messages) == (["keep.py", "sub/inner.py"], True)
+
+
+def test_builder_rescans_after_new_file_in_subdirectory(cached_builder):
+    builder, root, _, messages = cached_builder
+    scanned(builder, messages)
+    (root / "sub" / "new.py").write_text("new\n")
+    bump_mtime(root / "sub")
+    assert scanned(builder, messages) == (["keep.py", "skip.py", "sub/inner.py", "sub/new.py"], True)
+
+
+@pytest.mark.parametrize("kind", ["zip", "gztar"])
+def test_builder_reopens_rewritten_archive(tmp_path, kind):
+    root = tmp_path / "proj"
+    root.mkdir()
+    (root / "a.py").write_text("old = 1\n")
+    archive = shutil.make_archive(str(tmp_path / "snapshot"), kind, root_dir=tmp_path, base_dir="proj")
+    with ContextBuilder(archive, [".py"], [], [], [], [], include_tree=False) as builder:
+        assert "old = 1" in builder.render()
+
+        (root / "a.py").write_text("new = 2\n")
+        (root / "b.py").write_text("b = 1\n")
+        shutil.make_archive(str(tmp_path / "snapshot"), kind, root_dir=tmp_path, base_dir="proj")
+        bump_mtime(archive)
+        output = builder.render()
+    assert "new = 2" in output
+    assert "old = 1" not in output
+    assert "--- START OF FILE: b.py ---" in output
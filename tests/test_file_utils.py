@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from llm_context_copier.file_utils import get_project_structure, walk_files
+
+
+def symlink(target, link):
+    try:
+        os.symlink(target, link, target_is_directory=os.path.isdir(target))
+    except (OSError, NotImplementedError) as e:
+        pytest.skip(f"symlinks are not available: {e}")
+
+
+def walked(root) -> list:
+    return sorted(os.path.relpath(entry.path, root).replace(os.sep, '/') for entry in walk_files(root))
+
+
+def tree(root) -> str:
+    no_match = lambda p: False
+    return get_project_structure(root, [], no_match, no_match)
+
+
+@pytest.fixture
+def layout(tmp_path):
+    root = tmp_path / "root"
+    (root / "pkg").mkdir(parents=True)
+    (root / "pkg" / "mod.py").write_text("mod\n")
+    (root / "top.py").write_text("top\n")
+    outside = tmp_path / "outside"
+    (outside / "deep").mkdir(parents=True)
+    (outside / "deep" / "o.py").write_text("outside\n")
+    return root, outside
+
+
+def test_walk_dedupes_hardlinks_and_file_symlinks(layout):
+    root, _ = layout
+    try:
+        os.link(root / "top.py", root / "hard.py")
+    except OSError as e:
+        pytest.skip(f"hard links are not available: {e}")
+    symlink(root / "pkg" / "mod.py", root / "mod_link.py")
+    # Из пары ссылок на один inode выдается первая по порядку обхода
+    assert walked(root) == ["hard.py", "mod_link.py"]
+
+
+def test_walk_follows_inner_dir_symlink_once(layout):
+    root, _ = layout
+    symlink(root / "pkg", root / "alias")
+    assert walked(root) == ["alias/mod.py", "top.py"]
+
+
+def test_walk_survives_symlink_cycle(layout):
+    root, _ = layout
+    symlink(root, root / "pkg" / "loop")
+    assert walked(root) == ["pkg/mod.py", "top.py"]
+
+
+def test_walk_and_tree_skip_symlinks_outside_root(layout):
+    root, outside = layout
+    symlink(outside, root / "ext")
+    assert walked(root) == ["pkg/mod.py", "top.py"]
+    lines = tree(root).splitlines()
+    assert "├── ext" in lines
+    assert not any("deep" in line or "o.py" in line for line in lines)
+
+
+def test_tree_expands_symlink_cycle_once(layout):
+    root, _ = layout
+    symlink(root, root / "pkg" / "loop")
+    assert tree(root).splitlines() == [
+        "root",
+        "├── pkg",
+        "│   ├── loop",
+        "│   └── mod.py",
+        "└── top.py",
+    ]
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+from llm_context_copier import relevance_index
+from llm_context_copier.context_generator import ContextBuilder
+from llm_context_copier.manifest import content_hash, load_manifest, save_manifest
+from llm_context_copier.relevance_index import RelevanceIndex, get_index_path
+
+
+def build(path) -> ContextBuilder:
+    return ContextBuilder(str(path), [".py"], [], [], [], [], include_tree=False)
+
+
+def render(path, delta_from=None, query=None):
+    with build(path) as builder:
+        output = builder.render(query=query, delta_from=delta_from)
+        return output, builder.last_manifest, builder.source.cache_key
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / "project"
+    root.mkdir()
+    (root / "keep.py").write_text("keep = 1\n")
+    (root / "change.py").write_text("change = 1\n")
+    (root / "gone.py").write_text("gone = 1\n")
+    (root / "touch.py").write_text("touch = 1\n")
+    return root
+
+
+def test_manifest_round_trip(project, tmp_path):
+    _, manifest, cache_key = render(project)
+    assert set(manifest) == {"keep.py", "change.py", "gone.py", "touch.py"}
+    assert manifest["keep.py"]["hash"] == content_hash("keep = 1\n")
+
+    manifest_path = tmp_path / "out" / "manifest.json"
+    save_manifest(manifest_path, manifest, cache_key)
+    assert json.loads(manifest_path.read_text())["source"] == cache_key
+    assert load_manifest(manifest_path) == manifest
+    assert load_manifest(manifest_path, cache_key) == manifest
+
+
+def test_load_manifest_rejects_other_source(project, tmp_path):
+    manifest_path = tmp_path / "manifest.json"
+    save_manifest(manifest_path, {}, str(tmp_path / "other"))
+    with pytest.raises(ValueError, match="other"):
+        load_manifest(manifest_path, str(project))
+
+
+def test_load_manifest_rejects_unknown_version(tmp_path):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps({"version": 999, "files": {}}))
+    with pytest.raises(ValueError):
+        load_manifest(manifest_path)
+
+
+def test_delta_emits_only_changed_and_new_files(project):
+    _, previous, _ = render(project)
+
+    (project / "change.py").write_text("change = 2\n")
+    (project / "new.py").write_text("new = 1\n")
+    (project / "gone.py").unlink()
+    # Только новая метка времени, содержимое то же
+    stat = (project / "touch.py").stat()
+    os.utime(project / "touch.py", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    output, manifest, _ = render(project, delta_from=previous)
+    emitted = {line.split(": ")[1].rstrip(" -") for line in output.splitlines() if line.startswith("--- START OF FILE:")}
+    assert emitted == {"change.py", "new.py"}
+    assert "Deleted files (since previous manifest):\n- gone.py" in output
+
+    assert set(manifest) == {"keep.py", "change.py", "new.py", "touch.py"}
+    assert manifest["keep.py"] == previous["keep.py"]
+    assert manifest["touch.py"]["hash"] == previous["touch.py"]["hash"]
+    assert manifest["touch.py"]["mtime"] != previous["touch.py"]["mtime"]
+    assert manifest["change.py"]["hash"] == content_hash("change = 2\n")
+
+
+def test_delta_with_query_indexes_all_files(project, tmp_path, monkeypatch):
+    monkeypatch.setattr(relevance_index, "CACHE_DIR", tmp_path / "cache")
+    (project / "keep.py").write_text("widget = 1\n")
+    _, previous, cache_key = render(project)
+
+    (project / "change.py").write_text("widget = 2\n")
+    output, _, _ = render(project, delta_from=previous, query="widget")
+
+    emitted = [line for line in output.splitlines() if line.startswith("--- START OF FILE:")]
+    assert emitted == ["--- START OF FILE: change.py ---"]
+    index = RelevanceIndex.load(get_index_path(cache_key))
+    assert set(index.docs) == {"keep.py", "change.py", "gone.py", "touch.py"}
+
+
+def test_file_cut_by_total_limit_is_not_recorded(project):
+    with ContextBuilder(str(project), [".py"], [], [], [], [], include_tree=False, max_total_chars=15) as builder:
+        builder.render()
+        previous = builder.last_manifest
+    # change.py целиком (11 символов), gone.py обрезан до 4, остальные не прочитаны
+    assert set(previous) == {"change.py"}
+
+    output, _, _ = render(project, delta_from=previous)
+    assert "--- START OF FILE: gone.py ---" in output
+    assert "gone = 1" in output
+    assert "--- START OF FILE: change.py ---" not in output
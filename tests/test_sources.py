@@ -0,0 +1,150 @@
+import io
+import shutil
+import subprocess
+import tarfile
+import zipfile
+
+import pytest
+
+from llm_context_copier.context_generator import ContextBuilder
+from llm_context_copier.sources import GitRefSource, TarSource, ZipSource, open_source
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+BIG_TEXT = "0123456789" * 1000
+
+
+def git(repo, *args) -> str:
+    result = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=repo, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+
+@pytest.fixture
+def git_repo(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "src").mkdir(parents=True)
+    (repo / "README.md").write_text("# readme\n")
+    (repo / "src" / "app.py").write_text("print('committed')\n")
+    (repo / "big.txt").write_text(BIG_TEXT)
+    (repo / ".gitignore").write_text("*.log\n")
+    git(repo, "init", "-q")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "initial")
+    return repo
+
+
+def build(path, **kwargs) -> ContextBuilder:
+    return ContextBuilder(str(path), [".py", ".md", ".txt", ".log"], [], [], [], [], **kwargs)
+
+
+@needs_git
+def test_git_ref_lists_committed_files(git_repo):
+    (git_repo / "untracked.py").write_text("x = 1\n")
+    with GitRefSource(git_repo, "HEAD") as source:
+        assert set(source.files) == {".gitignore", "README.md", "big.txt", "src/app.py"}
+        entry = source.files["big.txt"]
+        assert entry.size == len(BIG_TEXT)
+        assert entry.mtime == git(git_repo, "rev-parse", "HEAD:big.txt").strip()
+
+
+@needs_git
+def test_git_ref_blob_over_read_limit_keeps_stream_in_sync(git_repo):
+    with GitRefSource(git_repo, "HEAD") as source:
+        results = list(source.read_texts(["big.txt", "src/app.py", "big.txt", "README.md"], 100))
+    assert [(path, error) for path, _, error in results] == [
+        ("big.txt", None), ("src/app.py", None), ("big.txt", None), ("README.md", None)
+    ]
+    assert [content for _, content, _ in results] == [
+        BIG_TEXT[:100], "print('committed')\n", BIG_TEXT[:100], "# readme\n"
+    ]
+
+
+@needs_git
+def test_git_ref_missing_ref(git_repo):
+    with pytest.raises(ValueError, match="no-such-branch"):
+        GitRefSource(git_repo, "no-such-branch")
+
+
+@needs_git
+def test_git_ref_reads_revision_and_leaves_worktree_clean(git_repo):
+    git(git_repo, "checkout", "-q", "-b", "feature")
+    (git_repo / "src" / "app.py").write_text("print('feature')\n")
+    git(git_repo, "commit", "-q", "-am", "feature")
+    git(git_repo, "checkout", "-q", "-")
+
+    with build(git_repo, ref="feature") as builder:
+        output = builder.render()
+    assert "print('feature')" in output
+    assert (git_repo / "src" / "app.py").read_text() == "print('committed')\n"
+    assert git(git_repo, "status", "--porcelain") == ""
+
+
+@needs_git
+def test_git_ref_cache_key_depends_on_ref(git_repo):
+    git(git_repo, "branch", "other")
+    with GitRefSource(git_repo, "HEAD") as head, GitRefSource(git_repo, "other") as other:
+        assert head.cache_key != other.cache_key
+
+
+def make_zip(path, files: dict):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+
+
+def make_tar(path, files: dict):
+    with tarfile.open(path, "w:gz") as tf:
+        for name, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+ARCHIVE_FILES = {
+    "proj/.gitignore": "*.log\n",
+    "proj/main.py": "print('main')\n",
+    "proj/pkg/util.py": "def util(): pass\n",
+    "proj/debug.log": "noise\n",
+}
+
+
+@pytest.mark.parametrize("suffix, make_archive, source_class", [
+    (".zip", make_zip, ZipSource),
+    (".tar.gz", make_tar, TarSource),
+])
+def test_archive_strips_single_top_dir_and_applies_gitignore(tmp_path, suffix, make_archive, source_class):
+    archive_path = tmp_path / f"snapshot{suffix}"
+    make_archive(archive_path, ARCHIVE_FILES)
+
+    with open_source(str(archive_path)) as source:
+        assert isinstance(source, source_class)
+        assert source.name == "proj"
+        assert set(source.files) == {".gitignore", "main.py", "pkg/util.py", "debug.log"}
+
+    with build(archive_path) as builder:
+        assert [entry.path for entry in builder.files()] == ["main.py", "pkg/util.py"]
+        output = builder.render()
+    assert "--- START OF FILE: main.py ---" in output
+    assert "debug.log" not in output.split("File contents:")[1]
+
+
+def test_archive_without_common_top_dir_keeps_paths(tmp_path):
+    archive_path = tmp_path / "flat.zip"
+    make_zip(archive_path, {"a.py": "a\n", "lib/b.py": "b\n"})
+    with open_source(str(archive_path)) as source:
+        assert source.name == "flat"
+        assert set(source.files) == {"a.py", "lib/b.py"}
+
+
+def test_tar_read_texts_reports_missing_files(tmp_path):
+    archive_path = tmp_path / "snapshot.tar.gz"
+    make_tar(archive_path, ARCHIVE_FILES)
+    with TarSource(archive_path) as source:
+        results = {path: (content, error) for path, content, error in source.read_texts(["pkg/util.py", "nope.py", "main.py"], 5)}
+    assert results["main.py"] == ("print", None)
+    assert results["pkg/util.py"] == ("def u", None)
+    assert isinstance(results["nope.py"][1], FileNotFoundError)